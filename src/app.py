@@ -1,6 +1,11 @@
 from flask import Flask, request, jsonify
 import psycopg2
 import os
+import json
+import base64
+import threading
+import glob
+import re
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
@@ -103,6 +108,28 @@ def formatar_validade(obj_data_validade): # Função renomeada
         return obj_data_validade.strftime('%d/%m/%Y')
     return "N/A"
 
+# --- Resposta Estruturada (formato "estruturado" do /api/prompt) ---
+# Linhas de item em todas as intenções: (nome, marca, secao, preco, validade, distancia)
+COLUNAS_ITEM = ["nome", "marca", "secao", "preco", "validade", "distancia"]
+
+def converter_valores_item(preco, validade, dist):
+    """Converte preço (Decimal), validade (date) e distância para tipos JSON."""
+    return (float(preco) if preco is not None else None,
+            validade.isoformat() if isinstance(validade, date) else None,
+            float(dist) if dist is not None else None)
+
+def linha_item_json(nome, marca, secao, preco, validade, dist=None):
+    return [nome, marca, secao, *converter_valores_item(preco, validade, dist)]
+
+def montar_resposta(opcoes, intencao, renderizar_mensagem, itens=(), **extras):
+    """Responde em texto (padrão) ou estruturado; a mensagem só é renderizada quando pedida."""
+    if not opcoes["estruturado"]:
+        return jsonify({"message": formatar_resposta_mensagem(renderizar_mensagem())}), 200
+    corpo = {"intencao": intencao, "colunas": COLUNAS_ITEM, "itens": [linha_item_json(*item) for item in itens], **extras}
+    if opcoes["incluir_mensagem"]:
+        corpo["message"] = formatar_resposta_mensagem(renderizar_mensagem())
+    return jsonify(corpo), 200
+
 # --- Funções Auxiliares para Hierarquia de Seções (Nomes em PT-BR) ---
 def obter_secao_por_nome(cur, nome_secao_normalizado): # Função e param renomeados
     cur.execute(
@@ -129,6 +156,320 @@ def obter_ids_secao_e_subsecoes(cur, id_secao): # Função e param renomeados
     return [row[0] for row in cur.fetchall()]
 
 
+# --- Snapshot em Memória dos Embeddings (Fallback da Intenção 7) ---
+# Seções: matriz float32 contígua em RAM. Itens (opcional): matriz em arquivo .npy mapeado em memória,
+# habilitada por SNAPSHOT_ITENS_ARQUIVO (prefixo do arquivo, compartilhado entre workers: um arquivo
+# `<prefixo>.v<versao>.npy` por versão do catálogo) para catálogos com até SNAPSHOT_ITENS_MAXIMO itens.
+SNAPSHOT_ITENS_ARQUIVO = os.getenv("SNAPSHOT_ITENS_ARQUIVO")
+SNAPSHOT_ITENS_MAXIMO = int(os.getenv("SNAPSHOT_ITENS_MAXIMO", "20000"))
+DIMENSAO_EMBEDDING = 768
+MARGEM_RERANQUEAMENTO = 8 # Candidatos extras recalculados com a diferença direta, como o <-> do pgvector
+
+SNAPSHOT_SECOES = None # dict: versao, ids, nomes, pais, matriz, normas_quad
+SNAPSHOT_ITENS = None # dict: versao, ids, matriz (memmap), normas_quad
+_LOCK_SNAPSHOTS = threading.Lock()
+_AVISO_VERSAO_CATALOGO_EMITIDO = False
+
+def obter_versao_catalogo(cur):
+    """Versão atual do catálogo, ou None se a tabela versao_catalogo não existir."""
+    global _AVISO_VERSAO_CATALOGO_EMITIDO
+    cur.execute("SAVEPOINT versao_catalogo;")
+    try:
+        cur.execute("SELECT versao FROM versao_catalogo WHERE id = 1;")
+        row = cur.fetchone()
+        cur.execute("RELEASE SAVEPOINT versao_catalogo;")
+        _AVISO_VERSAO_CATALOGO_EMITIDO = False
+        return row[0] if row else None
+    except psycopg2.Error as e:
+        if not _AVISO_VERSAO_CATALOGO_EMITIDO: # Avisa uma vez; volta a avisar se a tabela sumir depois de existir
+            print(f"AVISO: versao_catalogo indisponível, snapshots desativados: {e}")
+            _AVISO_VERSAO_CATALOGO_EMITIDO = True
+        cur.execute("ROLLBACK TO SAVEPOINT versao_catalogo;")
+        return None
+
+def montar_matriz_embeddings(embeddings):
+    matriz = np.ascontiguousarray(np.array(embeddings, dtype=np.float32).reshape(-1, DIMENSAO_EMBEDDING))
+    return matriz, np.einsum("ij,ij->i", matriz, matriz)
+
+def carregar_snapshot_secoes(cur, versao):
+    cur.execute("SELECT id, nome, secao_pai_id, embedding FROM secoes_catalogo WHERE embedding IS NOT NULL ORDER BY id;")
+    rows = cur.fetchall()
+    matriz, normas_quad = montar_matriz_embeddings([row[3] for row in rows])
+    print(f"Snapshot de seções carregado: {len(rows)} vetores (versão {versao}).")
+    return {"versao": versao, "ids": np.array([row[0] for row in rows], dtype=np.int64),
+            "nomes": [row[1] for row in rows], "pais": [row[2] for row in rows],
+            "matriz": matriz, "normas_quad": normas_quad}
+
+def carregar_snapshot_itens(cur, versao):
+    cur.execute("SELECT count(*) FROM itens_secao WHERE embedding IS NOT NULL;")
+    total = cur.fetchone()[0]
+    if total == 0 or total > SNAPSHOT_ITENS_MAXIMO:
+        print(f"Snapshot de itens desativado: {total} itens (máximo {SNAPSHOT_ITENS_MAXIMO}).")
+        return None
+    caminho = f"{SNAPSHOT_ITENS_ARQUIVO}.v{versao}.npy"
+    cur.execute("SELECT id FROM itens_secao WHERE embedding IS NOT NULL ORDER BY id;")
+    ids = np.array([row[0] for row in cur.fetchall()], dtype=np.int64)
+    try:
+        # Outro worker pode já ter gravado o arquivo desta versão: basta mapeá-lo
+        matriz_mapeada = np.load(caminho, mmap_mode="r") if os.path.exists(caminho) else None
+        if matriz_mapeada is None or matriz_mapeada.shape != (len(ids), DIMENSAO_EMBEDDING):
+            cur.execute("SELECT embedding FROM itens_secao WHERE embedding IS NOT NULL ORDER BY id;")
+            matriz, _ = montar_matriz_embeddings([row[0] for row in cur.fetchall()])
+            # Arquivo temporário + troca atômica: leitores nunca veem um .npy pela metade
+            caminho_tmp = f"{caminho}.{os.getpid()}.tmp"
+            try:
+                with open(caminho_tmp, "wb") as arquivo:
+                    np.save(arquivo, matriz)
+                os.replace(caminho_tmp, caminho)
+            finally:
+                if os.path.exists(caminho_tmp): os.remove(caminho_tmp)
+            matriz_mapeada = np.load(caminho, mmap_mode="r")
+            print(f"Snapshot de itens gravado em {caminho}: {len(ids)} vetores.")
+        remover_snapshots_itens_antigos(versao)
+    except (OSError, ValueError) as e:
+        print(f"Snapshot de itens desativado: erro ao gravar/ler {caminho}: {e}")
+        return None
+    return {"versao": versao, "ids": ids, "matriz": matriz_mapeada,
+            "normas_quad": np.einsum("ij,ij->i", matriz_mapeada, matriz_mapeada)}
+
+def remover_snapshots_itens_antigos(versao):
+    """Apaga arquivos (e temporários abandonados) de versões anteriores; mapeamentos abertos continuam válidos."""
+    padrao = re.compile(re.escape(SNAPSHOT_ITENS_ARQUIVO) + r"\.v(\d+)\.npy(\.\d+\.tmp)?$")
+    for caminho in glob.glob(f"{glob.escape(SNAPSHOT_ITENS_ARQUIVO)}.v*.npy*"):
+        encontrado = padrao.match(caminho)
+        if encontrado and int(encontrado.group(1)) < versao:
+            try: os.remove(caminho)
+            except OSError: pass
+
+def atualizar_snapshots(cur):
+    """Recarrega os snapshots se a versão do catálogo mudou. Retorna (snapshot_secoes, snapshot_itens)."""
+    global SNAPSHOT_SECOES, SNAPSHOT_ITENS
+    versao = obter_versao_catalogo(cur)
+    if versao is None:
+        return None, None
+    with _LOCK_SNAPSHOTS:
+        if SNAPSHOT_SECOES is None or SNAPSHOT_SECOES["versao"] != versao:
+            SNAPSHOT_SECOES = carregar_snapshot_secoes(cur, versao)
+        if SNAPSHOT_ITENS_ARQUIVO and (SNAPSHOT_ITENS is None or SNAPSHOT_ITENS["versao"] != versao):
+            SNAPSHOT_ITENS = carregar_snapshot_itens(cur, versao)
+            if SNAPSHOT_ITENS is None: SNAPSHOT_ITENS = {"versao": versao, "ids": None}
+        snapshot_itens = SNAPSHOT_ITENS if SNAPSHOT_ITENS_ARQUIVO and SNAPSHOT_ITENS["ids"] is not None else None
+        return SNAPSHOT_SECOES, snapshot_itens
+
+def vizinho_mais_proximo(snapshot, np_consulta):
+    """Índice e distância L2 do vetor mais próximo, na mesma ordem do operador <-> do pgvector.
+
+    ||x - q||² = ||x||² - 2·x·q + ||q||² é calculado para todas as linhas com um único produto
+    matriz-vetor; os melhores candidatos são recalculados com a diferença direta para evitar
+    que o erro de arredondamento da expansão troque a ordem de vizinhos quase empatados.
+    """
+    if len(snapshot["ids"]) == 0:
+        return None
+    q = np.asarray(np_consulta, dtype=np.float32)
+    dist_quad = snapshot["normas_quad"] - 2.0 * (snapshot["matriz"] @ q) + np.dot(q, q)
+    n_cand = min(len(dist_quad), 1 + MARGEM_RERANQUEAMENTO)
+    candidatos = np.sort(np.argpartition(dist_quad, n_cand - 1)[:n_cand])
+    diferencas = np.asarray(snapshot["matriz"][candidatos]) - q
+    dists = np.sqrt(np.einsum("ij,ij->i", diferencas, diferencas).astype(np.float64))
+    melhor = int(np.argmin(dists))
+    return int(candidatos[melhor]), float(dists[melhor])
+
+def buscar_secao_mais_proxima_snapshot(snapshot_secoes, np_consulta):
+    """Equivalente a `SELECT nome, id, secao_pai_id, embedding <-> q AS dist ... ORDER BY dist LIMIT 1`."""
+    resultado = vizinho_mais_proximo(snapshot_secoes, np_consulta)
+    if resultado is None: return None
+    idx, dist = resultado
+    return (snapshot_secoes["nomes"][idx], int(snapshot_secoes["ids"][idx]), snapshot_secoes["pais"][idx], dist)
+
+def buscar_item_mais_proximo_snapshot(cur, snapshot_itens, np_consulta, com_descricao=True):
+    """Equivalente à consulta de item mais próximo da Intenção 7; só os detalhes do item vencedor vêm do banco."""
+    resultado = vizinho_mais_proximo(snapshot_itens, np_consulta)
+    if resultado is None: return None
+    idx, dist = resultado
+    cur.execute(f"SELECT i.nome, {'i.descricao' if com_descricao else 'NULL'}, i.preco, i.validade, m.nome, sc.nome FROM itens_secao i LEFT JOIN marcas m ON i.marca_id = m.id LEFT JOIN secoes_catalogo sc ON i.secao_id = sc.id WHERE i.id = %s;",
+                (int(snapshot_itens["ids"][idx]),))
+    row = cur.fetchone()
+    if row is None: return None
+    n, d, p, v, m_nome, sc_nome = row
+    return (n, d, dist, p, v, m_nome, sc_nome)
+
+
+# --- Busca Semântica Estruturada (/api/search) ---
+LIMITE_PADRAO_BUSCA = 10
+LIMITE_MAXIMO_BUSCA = 50
+EF_SEARCH_MAXIMO = 1000 # Limite aceito pelo pgvector para hnsw.ef_search
+HNSW_MAX_SCAN_TUPLES = int(os.getenv("HNSW_MAX_SCAN_TUPLES", "20000")) # Teto da varredura iterativa por consulta
+
+def codificar_cursor(distancia, id_item, servidos):
+    """Cursor opaco (keyset) com a distância e o id do último item da página e o total já entregue."""
+    dados = json.dumps({"d": distancia, "id": id_item, "n": servidos}).encode("utf-8")
+    return base64.urlsafe_b64encode(dados).decode("ascii")
+
+def decodificar_cursor(cursor):
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return float(dados["d"]), int(dados["id"]), int(dados["n"])
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError("Cursor inválido.") from e
+
+def configurar_busca_vetorial(cur, limite):
+    """Ajusta o HNSW na transação atual para que buscas filtradas continuem usando o índice.
+
+    Com filtros no WHERE, o HNSW devolve só `ef_search` candidatos antes de filtrar; a varredura
+    iterativa (pgvector >= 0.8) continua percorrendo o grafo até completar o LIMIT ou visitar
+    `hnsw.max_scan_tuples` tuplas; nesse último caso a página volta incompleta (ver `handle_search`).
+    """
+    ef_search = min(max(40, limite * 2), EF_SEARCH_MAXIMO)
+    cur.execute("SELECT set_config('hnsw.ef_search', %s, true);", (str(ef_search),))
+    cur.execute("SAVEPOINT cfg_busca_vetorial;")
+    try:
+        # strict_order mantém a ordem exata por distância, necessária para a paginação por cursor
+        cur.execute("SET LOCAL hnsw.iterative_scan = strict_order;")
+        cur.execute("SELECT set_config('hnsw.max_scan_tuples', %s, true);", (str(HNSW_MAX_SCAN_TUPLES),))
+        cur.execute("RELEASE SAVEPOINT cfg_busca_vetorial;")
+    except psycopg2.Error as e:
+        print(f"AVISO: hnsw.iterative_scan indisponível (pgvector < 0.8?): {e}")
+        cur.execute("ROLLBACK TO SAVEPOINT cfg_busca_vetorial;")
+
+def extrair_filtros_busca(cur, filtros):
+    """Converte os filtros da requisição em condições SQL sobre `itens_secao i`.
+
+    Seção e marca são resolvidas antes para listas de ids, de modo que a consulta ANN
+    fique restrita a uma única tabela com filtros simples (pré-filtragem).
+    """
+    condicoes, params = ["i.embedding IS NOT NULL"], []
+    if not isinstance(filtros, dict):
+        raise ValueError("O campo 'filtros' deve ser um objeto JSON.")
+
+    if filtros.get("secao"):
+        info_secao = obter_secao_por_nome(cur, remover_acentos(str(filtros["secao"]).lower()))
+        if not info_secao:
+            raise ValueError(f"Seção '{filtros['secao']}' não encontrada.")
+        condicoes.append("i.secao_id = ANY(%s)")
+        params.append(obter_ids_secao_e_subsecoes(cur, info_secao[0]))
+
+    if filtros.get("marca"):
+        like_marca_unaccented = f"%{remover_acentos(str(filtros['marca']).lower())}%"
+        cur.execute("SELECT id FROM marcas WHERE unaccent(lower(nome)) LIKE unaccent(%s);", (like_marca_unaccented,))
+        condicoes.append("i.marca_id = ANY(%s)")
+        params.append([row[0] for row in cur.fetchall()])
+
+    for campo, operador in (("preco_min", ">="), ("preco_max", "<=")):
+        if filtros.get(campo) is not None:
+            try: valor = float(filtros[campo])
+            except (TypeError, ValueError): raise ValueError(f"O filtro '{campo}' deve ser numérico.")
+            condicoes.append(f"i.preco {operador} %s")
+            params.append(valor)
+
+    if filtros.get("valido_ate"):
+        try: data_minima = date.fromisoformat(str(filtros["valido_ate"]))
+        except ValueError: raise ValueError("O filtro 'valido_ate' deve estar no formato AAAA-MM-DD.")
+        condicoes.append("(i.validade IS NULL OR i.validade >= %s)")
+        params.append(data_minima)
+    elif filtros.get("apenas_validos"):
+        condicoes.append("(i.validade IS NULL OR i.validade >= CURRENT_DATE)")
+
+    return condicoes, params
+
+def aplicar_cursor(condicoes, params, np_embedding, cursor):
+    """Acrescenta a condição keyset (dist, id) > cursor às condições da busca."""
+    condicoes, params = list(condicoes), list(params)
+    if cursor:
+        ultima_dist, ultimo_id = cursor
+        condicoes.append("(i.embedding <-> %s > %s OR (i.embedding <-> %s = %s AND i.id > %s))")
+        params.extend([np_embedding, ultima_dist, np_embedding, ultima_dist, ultimo_id])
+    return condicoes, params
+
+def buscar_itens_semelhantes(cur, np_embedding, condicoes, params, limite, cursor=None):
+    """Top-k itens por distância L2 (<->), ordenados por (dist, id). Retorna limite + 1 linhas no máximo."""
+    condicoes, params = aplicar_cursor(condicoes, params, np_embedding, cursor)
+    # O CTE materializado faz a varredura ANN só em itens_secao; os JOINs ocorrem sobre os k candidatos.
+    cur.execute(f"""
+        WITH candidatos AS MATERIALIZED (
+            SELECT i.id, i.nome, i.marca_id, i.secao_id, i.preco, i.validade, i.embedding <-> %s AS dist
+            FROM itens_secao i
+            WHERE {" AND ".join(condicoes)}
+            ORDER BY dist, i.id LIMIT %s
+        )
+        SELECT c.id, c.nome, m.nome, sc.nome, c.preco, c.validade, c.dist
+        FROM candidatos c
+        LEFT JOIN marcas m ON c.marca_id = m.id
+        LEFT JOIN secoes_catalogo sc ON c.secao_id = sc.id
+        ORDER BY c.dist, c.id;
+    """, [np_embedding] + params + [limite + 1])
+    return cur.fetchall()
+
+def existem_mais_itens(cur, condicoes, params, servidos):
+    """Verifica se os filtros casam com mais de `servidos` itens, sem calcular distâncias.
+
+    Usada só quando a página vem incompleta, para distinguir o fim real dos resultados de uma
+    varredura iterativa interrompida por `hnsw.max_scan_tuples`. O OFFSET faz a consulta parar
+    assim que encontra o item `servidos + 1`.
+    """
+    cur.execute(f"SELECT EXISTS (SELECT 1 FROM itens_secao i WHERE {' AND '.join(condicoes)} OFFSET %s);",
+                list(params) + [servidos])
+    return cur.fetchone()[0]
+
+def serializar_item(linha):
+    """(id, nome, marca, secao, preco, validade, dist) -> dict JSON."""
+    id_item, nome, nome_marca, nome_secao, preco, validade, dist = linha
+    preco, validade, dist = converter_valores_item(preco, validade, dist)
+    return {
+        "id": id_item,
+        "nome": nome,
+        "marca": nome_marca,
+        "secao": nome_secao,
+        "preco": preco,
+        "validade": validade,
+        "distancia": dist,
+    }
+
+@app.route("/api/search", methods=["POST"])
+def handle_search():
+    dados_req = request.get_json(silent=True)
+    if not isinstance(dados_req, dict) or not str(dados_req.get("prompt", "")).strip():
+        return jsonify({"message": "Corpo da requisição JSON deve conter um campo 'prompt' não vazio."}), 400
+
+    limite = dados_req.get("limite", LIMITE_PADRAO_BUSCA)
+    if not isinstance(limite, int) or isinstance(limite, bool) or not 1 <= limite <= LIMITE_MAXIMO_BUSCA:
+        return jsonify({"message": f"O campo 'limite' deve ser um inteiro entre 1 e {LIMITE_MAXIMO_BUSCA}."}), 400
+
+    try:
+        cursor = decodificar_cursor(dados_req["cursor"]) if dados_req.get("cursor") else None
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    try:
+        np_embedding_prompt = np.array(get_embedding(str(dados_req["prompt"]).strip()))
+    except Exception as e:
+        print(f"Erro ao gerar embedding: {e}")
+        return jsonify({"message": f"Erro ao processar texto: {e}"}), 400
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+        try:
+            condicoes, params = extrair_filtros_busca(cur, dados_req.get("filtros") or {})
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        configurar_busca_vetorial(cur, limite)
+        linhas = buscar_itens_semelhantes(cur, np_embedding_prompt, condicoes, params, limite, cursor[:2] if cursor else None)
+        servidos = (cursor[2] if cursor else 0) + min(len(linhas), limite)
+        truncado = len(linhas) <= limite and existem_mais_itens(cur, condicoes, params, servidos)
+        cur.close()
+    except psycopg2.Error as e:
+        print(f"Erro de DB: {e}")
+        return jsonify({"message": "Problema ao acessar catálogo."}), 503
+    finally:
+        if conn: conn.close()
+
+    pagina = linhas[:limite]
+    proximo_cursor = codificar_cursor(float(pagina[-1][6]), pagina[-1][0], servidos) if len(linhas) > limite else None
+    return jsonify({"itens": [serializar_item(linha) for linha in pagina], "proximo_cursor": proximo_cursor,
+                    "truncado": truncado}), 200
+
+
 @app.route("/api/prompt", methods=["POST"])
 def handle_prompt():
     dados_req = request.get_json() # Var renomeada
@@ -139,6 +480,16 @@ def handle_prompt():
     if not texto_prompt:
         return jsonify({"message": "O campo 'prompt' não pode estar vazio."}), 400
 
+    formato = dados_req.get("formato", "texto")
+    if formato not in ("texto", "estruturado"):
+        return jsonify({"message": "O campo 'formato' deve ser 'texto' ou 'estruturado'."}), 400
+    incluir_mensagem = dados_req.get("incluir_mensagem", False)
+    if not isinstance(incluir_mensagem, bool):
+        return jsonify({"message": "O campo 'incluir_mensagem' deve ser um booleano (true ou false)."}), 400
+    opcoes = {"estruturado": formato == "estruturado", "incluir_mensagem": incluir_mensagem}
+    # A descrição só aparece na mensagem; sem mensagem, as consultas projetam NULL no lugar dela
+    com_descricao = not opcoes["estruturado"] or opcoes["incluir_mensagem"]
+
     mensagem_resposta = "" # Var renomeada
     conn = None
 
@@ -165,19 +516,19 @@ def handle_prompt():
         if any(kw in prompt_minusc_norm for kw in kws_catalogo_geral) and \
            not any(ex_kw in prompt_minusc_norm for ex_kw in kws_exclusao_int1):
             print("DEBUG: INTENÇÃO 1 DETECTADA - Catálogo Geral")
-            cur.execute("SELECT nome, id FROM secoes_catalogo WHERE secao_pai_id IS NULL ORDER BY nome;")
+            # Uma única consulta com a primeira subseção (exemplo) de cada seção principal
+            cur.execute("""
+                SELECT p.nome, (SELECT f.nome FROM secoes_catalogo f WHERE f.secao_pai_id = p.id ORDER BY f.nome LIMIT 1)
+                FROM secoes_catalogo p WHERE p.secao_pai_id IS NULL ORDER BY p.nome;
+            """)
             secoes_principais = cur.fetchall()
-            if secoes_principais:
-                lista_str_secoes = []
-                for nome_sec, id_sec in secoes_principais:
-                    filhas = obter_subsecoes_diretas(cur, id_sec)
-                    if filhas: lista_str_secoes.append(f"{nome_sec} (ex: {filhas[0][1]})")
-                    else: lista_str_secoes.append(nome_sec)
-                mensagem_resposta = (f"Nosso catálogo principal inclui: {', '.join(lista_str_secoes)}. "
-                                    "Pergunte 'o que tem em [nome da seção]?' para detalhes.")
-            else: mensagem_resposta = "Catálogo de seções ainda não definido."
             cur.close(); conn.close(); conn = None
-            return jsonify({"message": formatar_resposta_mensagem(mensagem_resposta)}), 200
+            def renderizar():
+                if not secoes_principais: return "Catálogo de seções ainda não definido."
+                lista_str_secoes = [f"{nome_sec} (ex: {exemplo})" if exemplo else nome_sec for nome_sec, exemplo in secoes_principais]
+                return (f"Nosso catálogo principal inclui: {', '.join(lista_str_secoes)}. "
+                        "Pergunte 'o que tem em [nome da seção]?' para detalhes.")
+            return montar_resposta(opcoes, "CATALOGO_GERAL", renderizar, secoes=[nome_sec for nome_sec, _ in secoes_principais])
 
         # INTENÇÃO 2: Listar ITENS por TIPO e MARCA
         kws_int2_prefixos = CACHE_PALAVRAS_CHAVE_INTENCAO.get("LISTAR_ITENS_TIPO_MARCA", {}).get("prefixo", [])
@@ -202,23 +553,22 @@ def handle_prompt():
             print(f"DEBUG: INTENÇÃO 2 DETECTADA - Tipo (norm): '{tipo_prod_int2_norm}', Marca (norm): '{marca_int2_norm}'")
             like_tipo_unaccented = f"%{tipo_prod_int2_norm.split()[0]}%"
             like_marca_unaccented = f"%{marca_int2_norm}%"
-            cur.execute("""
-                SELECT i.nome, i.descricao, m.nome as nome_marca, i.preco, i.validade
+            cur.execute(f"""
+                SELECT i.nome, m.nome as nome_marca, sc.nome, i.preco, i.validade, {"left(i.descricao, 50)" if com_descricao else "NULL"}
                 FROM itens_secao i
                 JOIN marcas m ON i.marca_id = m.id
+                LEFT JOIN secoes_catalogo sc ON i.secao_id = sc.id
                 WHERE (unaccent(lower(i.nome)) LIKE unaccent(%s) OR unaccent(lower(i.descricao)) LIKE unaccent(%s))
                   AND unaccent(lower(m.nome)) LIKE unaccent(%s)
                 ORDER BY i.nome LIMIT %s;
             """, (like_tipo_unaccented, like_tipo_unaccented, like_marca_unaccented, LIMITE_ITENS_LISTAGEM))
-            # ... (resto da lógica da Intenção 2, adaptando nomes de colunas se necessário ao buscar resultados)
-            itens_encontrados = cur.fetchall()
-            if itens_encontrados:
-                # (n, d, nome_marca, p, data_validade)
-                lista_itens_formatada = [f"- {item[0]} (Marca: {item[2].capitalize()}) Preço: R${item[3]:.2f} Validade: {formatar_validade(item[4])} Desc: {item[1][:50]}..." for item in itens_encontrados]
-                mensagem_resposta = f"Para '{tipo_prod_int2_norm}' da marca '{marca_int2_norm.capitalize()}':\n" + "\n".join(lista_itens_formatada)
-            else: mensagem_resposta = f"Não encontrei '{tipo_prod_int2_norm}' da marca '{marca_int2_norm.capitalize()}'."
+            itens_encontrados = cur.fetchall() # (n, nome_marca, secao, p, data_validade, desc_50)
             cur.close(); conn.close(); conn = None
-            return jsonify({"message": formatar_resposta_mensagem(mensagem_resposta)}), 200
+            def renderizar():
+                if not itens_encontrados: return f"Não encontrei '{tipo_prod_int2_norm}' da marca '{marca_int2_norm.capitalize()}'."
+                lista_itens_formatada = [f"- {item[0]} (Marca: {item[1].capitalize()}) Preço: R${item[3]:.2f} Validade: {formatar_validade(item[4])} Desc: {item[5] or ''}..." for item in itens_encontrados]
+                return f"Para '{tipo_prod_int2_norm}' da marca '{marca_int2_norm.capitalize()}': " + " ".join(lista_itens_formatada)
+            return montar_resposta(opcoes, "LISTAR_ITENS_TIPO_MARCA", renderizar, [item[:5] for item in itens_encontrados])
 
         # INTENÇÃO 3: Listar ITENS ou SUBCATEGORIAS por NOME DE SEÇÃO/SUBCATEGORIA
         kws_int3_prefixos = CACHE_PALAVRAS_CHAVE_INTENCAO.get("LISTAR_ITENS_CATEGORIA", {}).get("prefixo", [])
@@ -246,18 +596,20 @@ def handle_prompt():
                 id_secao_alvo, nome_secao_alvo, _ = info_secao
                 print(f"DEBUG: Seção '{nome_secao_alvo}' (ID: {id_secao_alvo}) encontrada.")
                 subcategorias_diretas = obter_subsecoes_diretas(cur, id_secao_alvo)
-                cur.execute("SELECT i.nome, m.nome, i.preco, i.validade, i.descricao FROM itens_secao i LEFT JOIN marcas m ON i.marca_id = m.id WHERE i.secao_id = %s ORDER BY i.nome LIMIT %s;", (id_secao_alvo, LIMITE_ITENS_LISTAGEM))
-                itens_diretos_secao = cur.fetchall()
-                resposta_formatada_itens = [f"- {item[0]} (Marca: {item[1].capitalize() if item[1] else 'N/A'}) Preço: R${item[2]:.2f} Validade: {formatar_validade(item[3])}" for item in itens_diretos_secao] if itens_diretos_secao else []
-                if subcategorias_diretas:
-                    nomes_subs = [s[1].capitalize() for s in subcategorias_diretas]
-                    resposta_subs_str = f"A seção '{nome_secao_alvo.capitalize()}' inclui: {', '.join(nomes_subs)}. "
-                    if not itens_diretos_secao: mensagem_resposta = resposta_subs_str + "Explorar qual?"
-                    else: mensagem_resposta = resposta_subs_str + f"Itens diretos:\n" + "\n".join(resposta_formatada_itens)
-                elif itens_diretos_secao: mensagem_resposta = f"Em '{nome_secao_alvo.capitalize()}':\n" + "\n".join(resposta_formatada_itens)
-                else: mensagem_resposta = f"Seção '{nome_secao_alvo.capitalize()}' sem subcategorias ou itens."
+                cur.execute("SELECT i.nome, m.nome, i.preco, i.validade FROM itens_secao i LEFT JOIN marcas m ON i.marca_id = m.id WHERE i.secao_id = %s ORDER BY i.nome LIMIT %s;", (id_secao_alvo, LIMITE_ITENS_LISTAGEM))
+                itens_diretos_secao = [(n, m_nome, nome_secao_alvo, p, v) for n, m_nome, p, v in cur.fetchall()]
                 cur.close(); conn.close(); conn = None
-                return jsonify({"message": formatar_resposta_mensagem(mensagem_resposta)}), 200
+                def renderizar():
+                    resposta_formatada_itens = " ".join(f"- {item[0]} (Marca: {item[1].capitalize() if item[1] else 'N/A'}) Preço: R${item[3]:.2f} Validade: {formatar_validade(item[4])}" for item in itens_diretos_secao)
+                    if subcategorias_diretas:
+                        nomes_subs = [s[1].capitalize() for s in subcategorias_diretas]
+                        resposta_subs_str = f"A seção '{nome_secao_alvo.capitalize()}' inclui: {', '.join(nomes_subs)}. "
+                        if not itens_diretos_secao: return resposta_subs_str + "Explorar qual?"
+                        return resposta_subs_str + "Itens diretos: " + resposta_formatada_itens
+                    if itens_diretos_secao: return f"Em '{nome_secao_alvo.capitalize()}': " + resposta_formatada_itens
+                    return f"Seção '{nome_secao_alvo.capitalize()}' sem subcategorias ou itens."
+                return montar_resposta(opcoes, "LISTAR_ITENS_CATEGORIA", renderizar, itens_diretos_secao,
+                                       secao=nome_secao_alvo, subsecoes=[s[1] for s in subcategorias_diretas])
             else: nome_secao_extraido_int3_norm = None
 
         # INTENÇÃO 4: Listar ITENS por MARCA
@@ -271,19 +623,19 @@ def handle_prompt():
             print(f"DEBUG: INTENÇÃO 4 DETECTADA - Marca (norm): '{marca_extraida_int4_norm}'")
             like_marca_unaccented = f"%{marca_extraida_int4_norm}%"
             cur.execute("""
-                SELECT i.nome, sc.nome, i.preco, i.validade
+                SELECT i.nome, m.nome, sc.nome, i.preco, i.validade
                 FROM itens_secao i JOIN marcas m ON i.marca_id = m.id
                 LEFT JOIN secoes_catalogo sc ON i.secao_id = sc.id
                 WHERE unaccent(lower(m.nome)) LIKE unaccent(%s)
                 ORDER BY sc.nome, i.nome LIMIT %s;
             """, (like_marca_unaccented, LIMITE_ITENS_LISTAGEM))
             itens_da_marca = cur.fetchall()
-            if itens_da_marca:
-                lista_itens_formatada = [f"- {item[0]} (Cat: {item[1].capitalize() if item[1] else 'N/A'}) Preço: R${item[2]:.2f} Validade: {formatar_validade(item[3])}" for item in itens_da_marca]
-                mensagem_resposta = f"Da marca '{marca_extraida_int4_norm.capitalize()}':\n" + "\n".join(lista_itens_formatada)
-            else: mensagem_resposta = f"Não encontrei itens da marca '{marca_extraida_int4_norm.capitalize()}'."
             cur.close(); conn.close(); conn = None
-            return jsonify({"message": formatar_resposta_mensagem(mensagem_resposta)}), 200
+            def renderizar():
+                if not itens_da_marca: return f"Não encontrei itens da marca '{marca_extraida_int4_norm.capitalize()}'."
+                lista_itens_formatada = [f"- {item[0]} (Cat: {item[2].capitalize() if item[2] else 'N/A'}) Preço: R${item[3]:.2f} Validade: {formatar_validade(item[4])}" for item in itens_da_marca]
+                return f"Da marca '{marca_extraida_int4_norm.capitalize()}': " + " ".join(lista_itens_formatada)
+            return montar_resposta(opcoes, "LISTAR_ITENS_MARCA", renderizar, itens_da_marca)
 
         # INTENÇÃO 5: Listar ITENS por TIPO DE PRODUTO (genérico)
         kws_int5_prefixos = CACHE_PALAVRAS_CHAVE_INTENCAO.get("LISTAR_ITENS_TIPO_GENERICO", {}).get("prefixo", [])
@@ -316,12 +668,12 @@ def handle_prompt():
                     ORDER BY RANDOM() LIMIT %s;
                 """, (like_tipo_unaccented, like_singular_unaccented, like_tipo_unaccented, like_singular_unaccented, LIMITE_ITENS_LISTAGEM))
                 itens_por_tipo = cur.fetchall()
-                if itens_por_tipo:
-                    lista_itens_formatada = [f"- {item[0]} (Marca: {item[1].capitalize() if item[1] else 'N/A'}, Cat: {item[2].capitalize() if item[2] else 'N/A'}) Preço: R${item[3]:.2f} Validade: {formatar_validade(item[4])}" for item in itens_por_tipo]
-                    mensagem_resposta = f"Sobre '{tipo_prod_extraido_int5_norm}', encontrei:\n" + "\n".join(lista_itens_formatada)
-                else: mensagem_resposta = f"Não encontrei itens do tipo '{tipo_prod_extraido_int5_norm}'."
                 cur.close(); conn.close(); conn = None
-                return jsonify({"message": formatar_resposta_mensagem(mensagem_resposta)}), 200
+                def renderizar():
+                    if not itens_por_tipo: return f"Não encontrei itens do tipo '{tipo_prod_extraido_int5_norm}'."
+                    lista_itens_formatada = [f"- {item[0]} (Marca: {item[1].capitalize() if item[1] else 'N/A'}, Cat: {item[2].capitalize() if item[2] else 'N/A'}) Preço: R${item[3]:.2f} Validade: {formatar_validade(item[4])}" for item in itens_por_tipo]
+                    return f"Sobre '{tipo_prod_extraido_int5_norm}', encontrei: " + " ".join(lista_itens_formatada)
+                return montar_resposta(opcoes, "LISTAR_ITENS_TIPO_GENERICO", renderizar, itens_por_tipo)
 
         # INTENÇÃO 6: Listar MARCAS por TIPO/CATEGORIA
         kws_int6_prefixos = CACHE_PALAVRAS_CHAVE_INTENCAO.get("LISTAR_MARCAS_POR_TIPO", {}).get("prefixo", [])
@@ -351,19 +703,27 @@ def handle_prompt():
             cur.execute(marcas_sql, params_sql)
             marcas_encontradas = [row[0] for row in cur.fetchall()]
             contexto_nome = info_secao_int6[1].capitalize() if info_secao_int6 else tipo_cat_extraido_int6_norm
-            if marcas_encontradas: mensagem_resposta = f"Marcas para '{contexto_nome}': {', '.join(marcas_encontradas)}."
-            else: mensagem_resposta = f"Não encontrei marcas para '{contexto_nome}'."
             cur.close(); conn.close(); conn = None
-            return jsonify({"message": formatar_resposta_mensagem(mensagem_resposta)}), 200
+            def renderizar():
+                if marcas_encontradas: return f"Marcas para '{contexto_nome}': {', '.join(marcas_encontradas)}."
+                return f"Não encontrei marcas para '{contexto_nome}'."
+            return montar_resposta(opcoes, "LISTAR_MARCAS_POR_TIPO", renderizar, marcas=marcas_encontradas)
 
         # INTENÇÃO 7: Fallback (Embedding)
         print("DEBUG: Nenhuma intenção específica (1-6) atendida. Fallback (Intenção 7).")
         if not conn: conn = get_db_connection(); cur = conn.cursor()
-        # Query adaptada para nomes PT-BR
-        cur.execute("SELECT i.nome, i.descricao, i.embedding <-> %s AS dist, i.preco, i.validade, m.nome FROM itens_secao i LEFT JOIN marcas m ON i.marca_id = m.id ORDER BY dist LIMIT 1;", (np_embedding_prompt,))
-        melhor_produto_geral = cur.fetchone()
-        cur.execute("SELECT nome, id, secao_pai_id, embedding <-> %s AS dist FROM secoes_catalogo ORDER BY dist LIMIT 1;", (np_embedding_prompt,))
-        melhor_categoria_geral_row = cur.fetchone()
+        snapshot_secoes, snapshot_itens = atualizar_snapshots(cur)
+        if snapshot_itens:
+            melhor_produto_geral = buscar_item_mais_proximo_snapshot(cur, snapshot_itens, np_embedding_prompt, com_descricao)
+        else:
+            # Query adaptada para nomes PT-BR
+            cur.execute(f"SELECT i.nome, {'i.descricao' if com_descricao else 'NULL'}, i.embedding <-> %s AS dist, i.preco, i.validade, m.nome, sc.nome FROM itens_secao i LEFT JOIN marcas m ON i.marca_id = m.id LEFT JOIN secoes_catalogo sc ON i.secao_id = sc.id ORDER BY dist LIMIT 1;", (np_embedding_prompt,))
+            melhor_produto_geral = cur.fetchone()
+        if snapshot_secoes:
+            melhor_categoria_geral_row = buscar_secao_mais_proxima_snapshot(snapshot_secoes, np_embedding_prompt)
+        else:
+            cur.execute("SELECT nome, id, secao_pai_id, embedding <-> %s AS dist FROM secoes_catalogo ORDER BY dist LIMIT 1;", (np_embedding_prompt,))
+            melhor_categoria_geral_row = cur.fetchone()
         dist_produto = melhor_produto_geral[2] if melhor_produto_geral else float('inf')
         dist_categoria = melhor_categoria_geral_row[3] if melhor_categoria_geral_row else float('inf')
         LIMIAR_FALLBACK_PRODUTO = 7.5
@@ -371,14 +731,18 @@ def handle_prompt():
         print(f"DEBUG Fallback: Dist Produto: {dist_produto}, Dist Categoria: {dist_categoria}")
 
         if dist_produto < LIMIAR_FALLBACK_PRODUTO and dist_produto < (dist_categoria - 0.2):
-            n,d,_,p,v,m_nome = melhor_produto_geral # nome, descricao, dist, preco, validade, nome_marca
-            mensagem_resposta = f"Encontrei '{n}'. Desc: {d if d else 'N/A'}. Marca: {m_nome.capitalize() if m_nome else 'N/A'}. Preço: R${p:.2f}. Validade: {formatar_validade(v)}."
+            n,d,dist,p,v,m_nome,sc_nome = melhor_produto_geral # nome, descricao, dist, preco, validade, nome_marca, nome_secao
+            renderizar = lambda: f"Encontrei '{n}'. Desc: {d if d else 'N/A'}. Marca: {m_nome.capitalize() if m_nome else 'N/A'}. Preço: R${p:.2f}. Validade: {formatar_validade(v)}."
+            resposta = montar_resposta(opcoes, "FALLBACK_SEMANTICO", renderizar, [(n, m_nome, sc_nome, p, v, dist)])
         elif dist_categoria < LIMIAR_FALLBACK_CATEGORIA:
-            nome_cat, id_cat, _, _ = melhor_categoria_geral_row
+            nome_cat, id_cat, _, dist_cat = melhor_categoria_geral_row
             subs = obter_subsecoes_diretas(cur, id_cat)
-            if subs: mensagem_resposta = f"Relacionado à seção '{nome_cat.capitalize()}', que inclui: {', '.join([s[1].capitalize() for s in subs])}. Explorar?"
-            else: mensagem_resposta = f"Relacionado à seção '{nome_cat.capitalize()}'. Ver itens?"
-        else: mensagem_resposta = "Desculpe, não entendi bem. Poderia reformular?"
+            def renderizar():
+                if subs: return f"Relacionado à seção '{nome_cat.capitalize()}', que inclui: {', '.join([s[1].capitalize() for s in subs])}. Explorar?"
+                return f"Relacionado à seção '{nome_cat.capitalize()}'. Ver itens?"
+            resposta = montar_resposta(opcoes, "FALLBACK_SEMANTICO", renderizar, secao=nome_cat,
+                                       subsecoes=[s[1] for s in subs], distancia_secao=float(dist_cat))
+        else: resposta = montar_resposta(opcoes, "FALLBACK_SEMANTICO", lambda: "Desculpe, não entendi bem. Poderia reformular?")
         if conn: cur.close(); conn.close(); conn = None
 
     except psycopg2.Error as e:
@@ -393,7 +757,7 @@ def handle_prompt():
     finally:
         if conn: print("DEBUG: Conexão aberta no finally."); cur.close(); conn.close()
 
-    return jsonify({"message": formatar_resposta_mensagem(mensagem_resposta)}), 200
+    return resposta
 
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
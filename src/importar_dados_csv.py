@@ -72,6 +72,27 @@ def criar_tabelas_se_nao_existirem(cur, conn_obj):
     cur.execute("""CREATE TABLE IF NOT EXISTS itens_secao (id SERIAL PRIMARY KEY, secao_id INTEGER REFERENCES secoes_catalogo(id), nome TEXT NOT NULL, descricao TEXT, preco NUMERIC(10, 2), validade DATE, marca_id INTEGER REFERENCES marcas(id), embedding VECTOR(768) );""")
     cur.execute("""CREATE TABLE IF NOT EXISTS palavras_chave_intencao (id SERIAL PRIMARY KEY, codigo_intencao TEXT NOT NULL, tipo_palavra_chave TEXT NOT NULL, valor_palavra_chave TEXT NOT NULL, prioridade INTEGER DEFAULT 0, ativo BOOLEAN NOT NULL DEFAULT TRUE, descricao TEXT );""")
     cur.execute("""CREATE INDEX IF NOT EXISTS idx_palavras_chave_intencao_codigo_tipo ON palavras_chave_intencao (codigo_intencao, tipo_palavra_chave, prioridade DESC);""")
+    # Índices ANN (HNSW, distância L2 = operador <->) usados pelo fallback e pelo /api/search
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_itens_secao_embedding_hnsw ON itens_secao USING hnsw (embedding vector_l2_ops);""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_secoes_catalogo_embedding_hnsw ON secoes_catalogo USING hnsw (embedding vector_l2_ops);""")
+    # Sem índices B-tree em itens_secao.secao_id/marca_id: eles levariam o planner a trocar o HNSW
+    # por bitmap scan + ordenação exata nas buscas filtradas do /api/search.
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_secoes_catalogo_secao_pai_id ON secoes_catalogo (secao_pai_id);""")
+    # Versão do catálogo: incrementada uma vez por transação que altera seções/itens; a API recarrega seus snapshots de embeddings quando ela muda
+    cur.execute("""CREATE TABLE IF NOT EXISTS versao_catalogo (id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1), versao BIGINT NOT NULL DEFAULT 0, atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now());""")
+    cur.execute("""INSERT INTO versao_catalogo (id) VALUES (1) ON CONFLICT (id) DO NOTHING;""")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION incrementar_versao_catalogo() RETURNS trigger AS $$
+        BEGIN
+            -- Marcador local à transação: importações com milhares de INSERTs atualizam a linha uma única vez
+            IF current_setting('catalogo.versao_incrementada', true) IS DISTINCT FROM 'on' THEN
+                UPDATE versao_catalogo SET versao = versao + 1, atualizado_em = now() WHERE id = 1;
+                PERFORM set_config('catalogo.versao_incrementada', 'on', true);
+            END IF;
+            RETURN NULL;
+        END; $$ LANGUAGE plpgsql;""")
+    for tabela in ("secoes_catalogo", "itens_secao"):
+        cur.execute(f"""CREATE OR REPLACE TRIGGER trg_versao_catalogo_{tabela} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabela} FOR EACH STATEMENT EXECUTE FUNCTION incrementar_versao_catalogo();""")
     print("Tabelas verificadas/criadas.")
 
 def limpar_dados_existentes(cur):